@@ -1,13 +1,20 @@
 # bot.py 
 import os
+import re
+import sys
+import string
+import hashlib
 import asyncio
+import time
 import random
 import datetime
-from typing import Dict, Any, Optional, Set, Tuple, List
+from pathlib import Path
+from typing import Dict, Any, Optional, Set, FrozenSet, Tuple, List
 
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, Dispatcher, F, types
 from aiogram.enums import ChatType
 from aiogram.filters import Command
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from dotenv import load_dotenv
 
@@ -18,7 +25,7 @@ import json
 load_dotenv()
 
 from database import (
-    init_db, add_or_update_player, set_country,
+    init_db, close_db, add_or_update_player, set_country,
     record_win, reset_streak, get_top50, get_player_rank_and_points, get_player_profile
 )
 
@@ -34,46 +41,138 @@ CITIES_FILE = os.path.join(PROJECT_DIR, "cities.txt")
 if not os.path.exists(CITIES_FILE):
     raise RuntimeError(f"Файл cities.txt не найден по пути {CITIES_FILE}. Помести туда список городов России (UTF-8).")
 
+# Таблица нормализации: заглавные -> строчные, ё -> е (один проход str.translate)
+RUSSIAN_UPPER = "АБВГДЕЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯ"
+_NORM_TABLE = str.maketrans({
+    "ё": "е",
+    "Ё": "е",
+    **{c: c.lower() for c in string.ascii_uppercase + RUSSIAN_UPPER},
+})
+_WS_RE = re.compile(r"\s+")
+
 # Загружаем список городов (нормализуем)
 def normalize_city(s: str) -> str:
     if not s:
         return ""
-    s = s.strip().lower()
-    s = " ".join(s.split())
-    s = s.replace("ё", "е")
-    return s
-
-with open(CITIES_FILE, encoding="utf-8") as f:
-    CITY_SET: Set[str] = set(normalize_city(line) for line in f if line.strip())
+    return _WS_RE.sub(" ", s.translate(_NORM_TABLE).strip())
+
+# файл читается целиком одним вызовом; пустые строки отсеиваются уже после нормализации
+# sys.intern: used_cities всех партий ссылаются на одни и те же объекты строк
+CITY_SET: Set[str] = {
+    sys.intern(c)
+    for c in map(normalize_city, Path(CITIES_FILE).read_text(encoding="utf-8").splitlines())
+    if c
+}
+
+# Города, разбитые по первой букве (для проверки хода и поиска оставшихся вариантов)
+EMPTY: FrozenSet[str] = frozenset()
+_by_letter: Dict[str, Set[str]] = {}
+for _c in CITY_SET:
+    _by_letter.setdefault(_c[0], set()).add(_c)
+CITIES_BY_LETTER: Dict[str, FrozenSet[str]] = {k: frozenset(v) for k, v in _by_letter.items()}
+del _by_letter, _c
 
 # буквы, которые не учитываются как последняя (берём предыдущую)
-SKIP_LAST = set("ьъый")
+SKIP_LAST: FrozenSet[str] = frozenset("ьъый")
 
 def last_significant_letter(word: str) -> Optional[str]:
+    # ё -> е уже сделано в normalize_city, поэтому достаточно одного прохода с конца
     word = normalize_city(word)
-    if not word:
-        return None
     # берём последний символ, пропуская SKIP_LAST
     for ch in reversed(word):
-        if ch.isalpha():
-            ch_norm = ch.replace("ё", "е")
-            if ch_norm in SKIP_LAST:
-                continue
-            return ch_norm
+        if ch.isalpha() and ch not in SKIP_LAST:
+            return ch
     return None
 
+# Последняя значимая буква для каждого города из базы — считаем один раз при старте
+CITY_LAST_LETTER: Dict[str, Optional[str]] = {c: last_significant_letter(c) for c in CITY_SET}
+
 # ---------- Структуры для игр ----------
-games: Dict[str, Dict[str, Any]] = {}
+class Game:
+    """Состояние одной партии (слоты вместо dict — меньше памяти и быстрее доступ к полям)."""
+    __slots__ = ("players", "turn", "last_letter", "used_cities", "timer_task",
+                 "deadline", "move_event", "started_at", "moves", "last_move")
+
+    def __init__(self, p1: int, p2: int, first_player: int):
+        self.players: List[int] = [p1, p2]
+        self.turn: int = first_player
+        self.last_letter: Optional[str] = None
+        self.used_cities: Set[str] = set()
+        self.timer_task: Optional[asyncio.Task] = None
+        self.deadline: float = 0.0
+        self.move_event = asyncio.Event()
+        self.started_at = datetime.datetime.now()
+        self.moves: int = 0
+        self.last_move: Optional[Tuple[int, str]] = None
+
+games: Dict[str, Game] = {}
 player_game: Dict[int, str] = {}
 waiting_player: Optional[int] = None
 
 # ---------- Rematch storage ----------
 rematch_offers: Dict[Tuple[int, int], Set[int]] = {}
 
+class RematchCB(CallbackData, prefix="rematch"):
+    """Данные кнопки реванша; упаковываются в "rematch:<p1>:<p2>" (как и раньше)."""
+    p1: int
+    p2: int
+
+# ---------- Кэш топа ----------
+TOP_CACHE_SECONDS = 10
+_TOP_CACHE: Dict[str, Any] = {"ts": 0.0, "data": None}
+_TOP_LOCK = asyncio.Lock()
+
+async def cached_top() -> List[Tuple[int, str, str, int, int]]:
+    """get_top50 с кэшем на TOP_CACHE_SECONDS (общий для /top и /api/top)."""
+    if _TOP_CACHE["data"] is not None and time.monotonic() - _TOP_CACHE["ts"] < TOP_CACHE_SECONDS:
+        return _TOP_CACHE["data"]
+    async with _TOP_LOCK:
+        # пока ждали блокировку, кэш мог обновить другой запрос
+        if _TOP_CACHE["data"] is not None and time.monotonic() - _TOP_CACHE["ts"] < TOP_CACHE_SECONDS:
+            return _TOP_CACHE["data"]
+        data = await get_top50()
+        _TOP_CACHE["data"] = data
+        _TOP_CACHE["ts"] = time.monotonic()
+        return data
+
 # ---------- Aiogram init ----------
 bot = Bot(token=TOKEN)
 dp = Dispatcher()
 
+# ---------- Очередь исходящих сообщений ----------
+# Telegram ограничивает бота ~30 сообщениями в секунду
+SEND_RATE = 30
+send_q: "asyncio.Queue[Tuple[int, str, Dict[str, Any]]]" = asyncio.Queue()
+
+def send(chat_id: int, text: str, **kwargs):
+    """Поставить сообщение в очередь отправки (не блокирует игровую логику)."""
+    send_q.put_nowait((chat_id, text, kwargs))
+
+async def _send_chat(chat_id: int, items: List[Tuple[str, Dict[str, Any]]]):
+    # сообщения одному чату уходят по порядку
+    for text, kwargs in items:
+        try:
+            await bot.send_message(chat_id, text, **kwargs)
+        except Exception:
+            pass
+
+async def send_worker():
+    """Забирает до SEND_RATE сообщений, отправляет разным чатам параллельно и выдерживает лимит."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await send_q.get()]
+        while len(batch) < SEND_RATE and not send_q.empty():
+            batch.append(send_q.get_nowait())
+        started = loop.time()
+        by_chat: Dict[int, List[Tuple[str, Dict[str, Any]]]] = {}
+        for chat_id, text, kwargs in batch:
+            by_chat.setdefault(chat_id, []).append((text, kwargs))
+        await asyncio.gather(*(_send_chat(chat_id, items) for chat_id, items in by_chat.items()))
+        # токен-бакет: n сообщений "стоят" n / SEND_RATE секунд
+        pause = len(batch) / SEND_RATE - (loop.time() - started)
+        if pause > 0:
+            await asyncio.sleep(pause)
+
 # ---------- Утилиты ----------
 def make_game_id(a: int, b: int) -> str:
     return f"game_{min(a,b)}_{max(a,b)}"
@@ -81,6 +180,10 @@ def make_game_id(a: int, b: int) -> str:
 def pair_key(a: int, b: int) -> Tuple[int,int]:
     return (min(a,b), max(a,b))
 
+def link(uid: int, label: str) -> str:
+    """HTML-ссылка на игрока: <a href='tg://user?id=...'>label</a>."""
+    return f"<a href='tg://user?id={uid}'>{label}</a>"
+
 async def cancel_and_await(task: Optional[asyncio.Task]):
     if not task:
         return
@@ -98,36 +201,33 @@ async def start_turn(game_id: str):
     game = games.get(game_id)
     if not game:
         return
-    user_to_move = game["turn"]
-    opponent = game["players"][0] if game["players"][1] == user_to_move else game["players"][1]
-
-    last_move = game.get("last_move")
-
-    try:
-        # дружелюбное уведомление текущему игроку
-        await bot.send_message(user_to_move,
-            f"🔔 Твой ход! Назови город на букву: *{(game['last_letter'] or '?').upper()}*.\n"
-            f"У тебя есть {ROUND_SECONDS} секунд — не спеши, постарайся написать правильно.",
-            parse_mode="Markdown")
-
-        # показываем оппоненту последний ход, если он есть
-        if last_move:
-            mover_id, city = last_move
-            await bot.send_message(opponent,
-                                   f"✳️ Соперник <a href='tg://user?id={mover_id}'>назвал</a>: <b>{city}</b>.\n"
-                                   f"Ждём ответ (ход <a href='tg://user?id={user_to_move}'>игрока</a>).",
-                                   parse_mode="HTML")
-        else:
-            await bot.send_message(opponent, f"⌛️ Ожидаем ход соперника <a href='tg://user?id={user_to_move}'>игрока</a>...",
-                                   parse_mode="HTML")
-    except Exception:
-        pass
+    user_to_move = game.turn
+    opponent = game.players[0] if game.players[1] == user_to_move else game.players[1]
+
+    last_move = game.last_move
+
+    # дружелюбное уведомление текущему игроку
+    send(user_to_move,
+         f"🔔 Твой ход! Назови город на букву: *{(game.last_letter or '?').upper()}*.\n"
+         f"У тебя есть {ROUND_SECONDS} секунд — не спеши, постарайся написать правильно.",
+         parse_mode="Markdown")
+
+    # показываем оппоненту последний ход, если он есть
+    if last_move:
+        mover_id, city = last_move
+        send(opponent,
+             f"✳️ Соперник {link(mover_id, 'назвал')}: <b>{city}</b>.\n"
+             f"Ждём ответ (ход {link(user_to_move, 'игрока')}).",
+             parse_mode="HTML")
+    else:
+        send(opponent, f"⌛️ Ожидаем ход соперника {link(user_to_move, 'игрока')}...",
+             parse_mode="HTML")
 
-    old_task = game.get("timer_task")
-    if old_task and not old_task.done():
-        await cancel_and_await(old_task)
-    task = asyncio.create_task(turn_timeout(game_id, user_to_move))
-    game["timer_task"] = task
+    # один таймер на партию: ход только сдвигает дедлайн, задача не пересоздаётся
+    game.deadline = asyncio.get_running_loop().time() + ROUND_SECONDS
+    task = game.timer_task
+    if task is None or task.done():
+        game.timer_task = asyncio.create_task(turn_timeout(game_id))
 
 async def create_game_between(p1: int, p2: int, first_player: Optional[int] = None):
     gid = make_game_id(p1, p2)
@@ -135,120 +235,94 @@ async def create_game_between(p1: int, p2: int, first_player: Optional[int] = No
         return gid
     if first_player is None:
         first_player = p1
-    games[gid] = {
-        "players": [p1, p2],
-        "turn": first_player,
-        "last_letter": None,
-        "used_cities": set(),
-        "timer_task": None,
-        "started_at": datetime.datetime.now(),
-        "moves": 0,
-        "last_move": None
-    }
+    games[gid] = Game(p1, p2, first_player)
     player_game[p1] = gid
     player_game[p2] = gid
 
-    try:
-        await bot.send_message(p1, f"✅ Найден соперник! Игра началась — ты ходишь {'первым' if first_player==p1 else 'вторым'}.\n"
-                                   "Отправь название любого города (Россия). Удачи!")
-        await bot.send_message(p2, f"✅ Найден соперник! Игра началась. Ждём хода соперника <a href='tg://user?id={p1}'>игрока</a>.",
-                               parse_mode="HTML")
-    except Exception:
-        pass
+    send(p1, f"✅ Найден соперник! Игра началась — ты ходишь {'первым' if first_player==p1 else 'вторым'}.\n"
+             "Отправь название любого города (Россия). Удачи!")
+    send(p2, f"✅ Найден соперник! Игра началась. Ждём хода соперника {link(p1, 'игрока')}.",
+         parse_mode="HTML")
 
     await start_turn(gid)
     return gid
 
 async def offer_rematch_to_players(p1: int, p2: int):
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="↻ Реванш", callback_data=f"rematch:{p1}:{p2}")]
+        [InlineKeyboardButton(text="↻ Реванш", callback_data=RematchCB(p1=p1, p2=p2).pack())]
     ])
-    try:
-        await bot.send_message(p1, "Нажмите кнопку, чтобы предложить или принять реванш.", reply_markup=kb)
-        await bot.send_message(p2, "Нажмите кнопку, чтобы предложить или принять реванш.", reply_markup=kb)
-    except Exception:
-        pass
+    send(p1, "Нажмите кнопку, чтобы предложить или принять реванш.", reply_markup=kb)
+    send(p2, "Нажмите кнопку, чтобы предложить или принять реванш.", reply_markup=kb)
 
 async def end_game(game_id: str, winner_id: Optional[int], reason: str):
     game = games.get(game_id)
     if not game:
         return
-    p1, p2 = game["players"]
-    task = game.get("timer_task")
-    if task and not task.done():
-        try:
-            task.cancel()
-            await task
-        except asyncio.CancelledError:
-            pass
-        except Exception:
-            pass
+    p1, p2 = game.players
+    task = game.timer_task
+    # end_game может вызываться из самого таймера — себя не отменяем
+    if task is not asyncio.current_task():
+        await cancel_and_await(task)
 
     if winner_id is None:
         # дружелюбный текст для ничьи
         text = f"🤝 Ничья — {reason}."
-        try:
-            await bot.send_message(p1, text)
-            await bot.send_message(p2, text)
-        except Exception:
-            pass
-        # при ничье — опционально сбрасываем серии
-        try:
-            await reset_streak(p1)
-            await reset_streak(p2)
-        except Exception:
-            pass
+        send(p1, text)
+        send(p2, text)
+        # при ничье — опционально сбрасываем серии (оба запроса сразу, ошибки не прерывают друг друга)
+        await asyncio.gather(reset_streak(p1), reset_streak(p2), return_exceptions=True)
     else:
         loser = p1 if winner_id == p2 else p2
         # отправляем персональные более тёплые сообщения (теперь победитель видит соперника)
-        try:
-            # победителю — показываем ссылку на соперника (loser)
-            await bot.send_message(
-                winner_id,
-                f"🎉 Поздравляю! Ты победил <a href='tg://user?id={loser}'>соперника</a>.\nПричина: {reason}.",
-                parse_mode="HTML"
-            )
-            # проигравшему — показываем ссылку на победителя
-            await bot.send_message(
-                loser,
-                f"😔 Увы, ты проиграл — победил <a href='tg://user?id={winner_id}'>соперник</a>.\nПричина: {reason}.",
-                parse_mode="HTML"
-            )
-        except Exception:
-            pass
-        try:
-            await record_win(winner_id)
-        except Exception:
-            pass
-        # сброс серии проигравшего
-        try:
-            await reset_streak(loser)
-        except Exception:
-            pass
-
-    for uid in list(game["players"]):
+        # победителю — показываем ссылку на соперника (loser)
+        send(
+            winner_id,
+            f"🎉 Поздравляю! Ты победил {link(loser, 'соперника')}.\nПричина: {reason}.",
+            parse_mode="HTML"
+        )
+        # проигравшему — показываем ссылку на победителя
+        send(
+            loser,
+            f"😔 Увы, ты проиграл — победил {link(winner_id, 'соперник')}.\nПричина: {reason}.",
+            parse_mode="HTML"
+        )
+        # победа + сброс серии проигравшего одним пакетом
+        await asyncio.gather(record_win(winner_id), reset_streak(loser), return_exceptions=True)
+
+    for uid in list(game.players):
         player_game.pop(uid, None)
     games.pop(game_id, None)
 
     await offer_rematch_to_players(p1, p2)
 
-async def turn_timeout(game_id: str, user_id: int):
+async def turn_timeout(game_id: str):
+    """Таймер партии: ждёт game.move_event до game.deadline; ход будит таймер с новым дедлайном."""
+    loop = asyncio.get_running_loop()
     try:
-        await asyncio.sleep(ROUND_SECONDS)
-        game = games.get(game_id)
-        if not game:
-            return
-        if game.get("turn") == user_id:
-            opponent = game["players"][0] if game["players"][1] == user_id else game["players"][1]
+        while True:
+            game = games.get(game_id)
+            if not game:
+                return
+            move_event = game.move_event
+            move_event.clear()
+            try:
+                async with asyncio.timeout_at(game.deadline):
+                    await move_event.wait()
+                continue
+            except TimeoutError:
+                pass
+            # ход мог прийти, пока таймер просыпался
+            if loop.time() < game.deadline:
+                continue
+            user_id = game.turn
+            opponent = game.players[0] if game.players[1] == user_id else game.players[1]
             await end_game(game_id, opponent, reason=f"просрочил ход (не успел за {ROUND_SECONDS} сек)")
+            return
     except asyncio.CancelledError:
         return
     except Exception:
         return
 
-def is_user_in_game(user_id: int) -> bool:
-    return user_id in player_game
-
 # ---------- Команды ----------
 
 @dp.message(Command("start"))
@@ -278,7 +352,7 @@ async def cmd_play(message: types.Message):
     user_id = message.from_user.id
     await add_or_update_player(user_id, message.from_user.username)
 
-    if is_user_in_game(user_id):
+    if user_id in player_game:
         await message.reply("Ты уже в игре — сначала завершите текущую партию (/surrender) или подожди её окончания.")
         return
 
@@ -310,20 +384,20 @@ async def cmd_leave(message: types.Message):
 @dp.message(Command("surrender"))
 async def cmd_surrender(message: types.Message):
     user_id = message.from_user.id
-    if not is_user_in_game(user_id):
+    gid = player_game.get(user_id)
+    if gid is None:
         await message.reply("Ты сейчас не в игре.")
         return
-    gid = player_game.get(user_id)
     game = games.get(gid)
     if not game:
         await message.reply("Не удалось найти игру — попробуй позже.")
         return
-    opponent = game["players"][0] if game["players"][1] == user_id else game["players"][1]
+    opponent = game.players[0] if game.players[1] == user_id else game.players[1]
     await end_game(gid, opponent, reason="сдался (/surrender)")
 
 @dp.message(Command("top"))
 async def cmd_top(message: types.Message):
-    top = await get_top50()
+    top = await cached_top()
     if not top:
         await message.reply("Пока нет побед — топ пуст. Стань первым! 🏅")
         return
@@ -390,23 +464,21 @@ async def cmd_cancel_rematch(message: types.Message):
         return
     await message.reply("Окей — твоё предложение реванша отменено.")
     for other in to_notify:
-        try:
-            await bot.send_message(other, "Соперник отменил своё предложение реванша.")
-        except Exception:
-            pass
+        send(other, "Соперник отменил своё предложение реванша.")
 
 # ---------- Обработка ходов (только не-команды) ----------
-@dp.message(lambda message: not any(getattr(e, "type", "") == "bot_command" for e in (message.entities or [])))
+# сообщения без текста (стикеры и т.п.) тоже попадают сюда — handle_move подскажет написать текстом
+@dp.message(~F.text.startswith("/"))
 async def handle_move(message: types.Message):
     user_id = message.from_user.id
-    if not is_user_in_game(user_id):
-        return
     gid = player_game.get(user_id)
+    if gid is None:
+        return
     game = games.get(gid)
     if not game:
         return
 
-    if game["turn"] != user_id:
+    if game.turn != user_id:
         await message.reply("Сейчас не твой ход. Подожди, пожалуйста — ход соперника.")
         return
 
@@ -416,60 +488,55 @@ async def handle_move(message: types.Message):
         await message.reply("Не распознал название города. Напиши только название (текстом).")
         return
 
-    if city not in CITY_SET:
-        await message.reply("Кажется, такого города нет в базе. Проверь написание и попробуй снова.")
+    # сначала самые дешёвые проверки: буква, затем уже названные, затем база
+    needed = game.last_letter
+    if needed and city[0] != needed:
+        await message.reply(f"Нужно назвать город на букву *{needed.upper()}*. Попробуй ещё раз.", parse_mode="Markdown")
         return
 
-    if city in game["used_cities"]:
+    if city in game.used_cities:
         await message.reply("Этот город уже был использован в этой партии — выбери другой.")
         return
 
-    if game["last_letter"]:
-        first_letter = city[0]
-        needed = game["last_letter"]
-        if first_letter != needed:
-            await message.reply(f"Нужно назвать город на букву *{needed.upper()}*. Попробуй ещё раз.", parse_mode="Markdown")
-            return
+    if city not in CITIES_BY_LETTER.get(city[0], EMPTY):
+        await message.reply("Кажется, такого города нет в базе. Проверь написание и попробуй снова.")
+        return
 
-    game["used_cities"].add(city)
-    game["moves"] += 1
-    nxt = last_significant_letter(city)
-    game["last_letter"] = nxt
+    # ввод уже проверен по базе — берём каноничный (интернированный) объект строки
+    city = sys.intern(city)
+    game.used_cities.add(city)
+    game.moves += 1
+    nxt = CITY_LAST_LETTER[city]
+    game.last_letter = nxt
 
-    game["last_move"] = (user_id, city)
+    game.last_move = (user_id, city)
 
-    task = game.get("timer_task")
-    if task and not task.done():
-        await cancel_and_await(task)
-        game["timer_task"] = None
+    # если на нужную букву городов не осталось — сразу ничья, не ждём таймаута
+    if nxt and CITIES_BY_LETTER.get(nxt, EMPTY) <= game.used_cities:
+        await end_game(gid, None, reason=f"города на букву {nxt.upper()} закончились")
+        return
 
-    p1, p2 = game["players"]
+    p1, p2 = game.players
     opponent = p1 if p2 == user_id else p2
-    game["turn"] = opponent
-
+    game.turn = opponent
+    # будим таймер партии — он подхватит новый дедлайн
+    game.deadline = asyncio.get_running_loop().time() + ROUND_SECONDS
+    game.move_event.set()
+
+    send(opponent,
+         f"✳️ Соперник {link(user_id, 'назвал')}: <b>{city}</b>\n"
+         f"Твой ход — ответь городом на букву <b>{(game.last_letter or '?').upper()}</b>.\n"
+         f"У тебя {ROUND_SECONDS} сек. Удачи!",
+         parse_mode="HTML")
     try:
         await message.reply(f"✅ Принято: {city}. Ход передан сопернику — жди его ответа.")
-        await bot.send_message(opponent,
-                               f"✳️ Соперник <a href='tg://user?id={user_id}'>назвал</a>: <b>{city}</b>\n"
-                               f"Твой ход — ответь городом на букву <b>{(game['last_letter'] or '?').upper()}</b>.\n"
-                               f"У тебя {ROUND_SECONDS} сек. Удачи!",
-                               parse_mode="HTML")
     except Exception:
         pass
 
-    task = asyncio.create_task(turn_timeout(gid, opponent))
-    game["timer_task"] = task
-
 # ---------- Callback для рематча ----------
-@dp.callback_query(lambda c: c.data and c.data.startswith("rematch:"))
-async def callback_rematch(cb: types.CallbackQuery):
-    data = cb.data
-    try:
-        _, s1, s2 = data.split(":")
-        p1 = int(s1); p2 = int(s2)
-    except Exception:
-        await cb.answer("Некорректный запрос.")
-        return
+@dp.callback_query(RematchCB.filter())
+async def callback_rematch(cb: types.CallbackQuery, callback_data: RematchCB):
+    p1, p2 = callback_data.p1, callback_data.p2
     user_id = cb.from_user.id
     key = pair_key(p1, p2)
     offers = rematch_offers.get(key)
@@ -481,10 +548,7 @@ async def callback_rematch(cb: types.CallbackQuery):
         offers.discard(user_id)
         await cb.answer("Ты отменил(а) своё согласие на реванш.")
         other = p1 if p2 == user_id else p2
-        try:
-            await bot.send_message(other, "Соперник отменил согласие на реванш.")
-        except Exception:
-            pass
+        send(other, "Соперник отменил согласие на реванш.")
         if not offers:
             rematch_offers.pop(key, None)
         return
@@ -492,31 +556,42 @@ async def callback_rematch(cb: types.CallbackQuery):
         offers.add(user_id)
         await cb.answer("Ты согласился(ась) на реванш. Ждём второго игрока...")
         other = p1 if p2 == user_id else p2
-        try:
-            await bot.send_message(other, "Соперник согласился на реванш — нажми кнопку, чтобы принять.")
-        except Exception:
-            pass
+        send(other, "Соперник согласился на реванш — нажми кнопку, чтобы принять.")
 
     if offers == set(key):
         rematch_offers.pop(key, None)
-        if is_user_in_game(p1) or is_user_in_game(p2):
-            try:
-                await bot.send_message(p1, "Один из игроков сейчас в другой партии — реванш отменён.")
-                await bot.send_message(p2, "Один из игроков сейчас в другой партии — реванш отменён.")
-            except Exception:
-                pass
+        if p1 in player_game or p2 in player_game:
+            send(p1, "Один из игроков сейчас в другой партии — реванш отменён.")
+            send(p2, "Один из игроков сейчас в другой партии — реванш отменён.")
             return
         await create_game_between(p1, p2, first_player=p1)
 
 # ---------- Веб-сервер для сайта ----------
-async def handle_index(request: web.Request):
+# index.html читается один раз в start_web_server
+INDEX_BYTES: Optional[bytes] = None
+INDEX_ETAG: Optional[str] = None
+
+def load_index():
+    global INDEX_BYTES, INDEX_ETAG
     index_path = os.path.join(PROJECT_DIR, "index.html")
     if not os.path.exists(index_path):
+        INDEX_BYTES = INDEX_ETAG = None
+        return
+    with open(index_path, "rb") as f:
+        INDEX_BYTES = f.read()
+    INDEX_ETAG = f'"{hashlib.md5(INDEX_BYTES, usedforsecurity=False).hexdigest()}"'
+
+async def handle_index(request: web.Request):
+    if INDEX_BYTES is None:
         return web.Response(text="index.html не найден", status=404)
-    return web.FileResponse(index_path)
+    if_none_match = request.headers.get("If-None-Match", "")
+    if if_none_match.strip() == "*" or INDEX_ETAG in (t.strip() for t in if_none_match.split(",")):
+        return web.Response(status=304, headers={"ETag": INDEX_ETAG})
+    return web.Response(body=INDEX_BYTES, content_type="text/html", charset="utf-8",
+                        headers={"ETag": INDEX_ETAG})
 
 async def handle_api_top(request: web.Request):
-    top = await get_top50()
+    top = await cached_top()
     result = []
     # get_top50 expected to return rows with (rank, username, country, wins, max_streak)
     for rank, username, country, wins, max_streak in top:
@@ -529,29 +604,31 @@ async def handle_api_top(request: web.Request):
         })
     return web.json_response(result)
 
+# Тело ответа на пинг — готовые байты, без кодирования строки на каждый запрос
+OK_BYTES = b"OK"
+
 # Новый обработчик для пинга UptimeRobot / health checks
 async def handle_uptime_ping(request: web.Request):
     """
     Быстрый ответ для мониторинга (UptimeRobot, Render и т.п.).
-    Поддерживает GET/HEAD/POST — возвращает 200 OK.
+    Поддерживает любые HTTP-методы (GET/HEAD/POST...) — возвращает 200 OK.
     """
     # опционально можно логировать source ip / тело, но не обязательно
     # body = await request.text()  # не нужно, чтобы ответ был быстрым
-    return web.Response(text="OK", status=200)
+    return web.Response(body=OK_BYTES, content_type="text/plain")
 
 async def start_web_server():
+    load_index()
     app = web.Application()
     app.router.add_get("/", handle_index)
     app.router.add_get("/api/top", handle_api_top)
 
     # маршруты для приёма пинга от UptimeRobot / health checks
-    # поддерживаем основные HTTP методы — GET/POST (HEAD обрабатывается автоматически aiohttp)
-    app.router.add_get("/ping", handle_uptime_ping)
-    app.router.add_post("/ping", handle_uptime_ping)
+    # один маршрут на все HTTP методы (GET/HEAD/POST...)
+    app.router.add_route("*", "/ping", handle_uptime_ping)
 
     # дополнительный "стандартный" путь для health checks
-    app.router.add_get("/healthz", handle_uptime_ping)
-    app.router.add_post("/healthz", handle_uptime_ping)
+    app.router.add_route("*", "/healthz", handle_uptime_ping)
 
     runner = web.AppRunner(app)
     await runner.setup()
@@ -566,16 +643,30 @@ async def on_startup():
     await init_db()
     print("DB initialized.")
 
+@dp.shutdown()
+async def on_shutdown():
+    """Остановка polling (в т.ч. по SIGTERM): отменяем таймеры всех партий разом."""
+    tasks = [g.timer_task for g in games.values() if g.timer_task and not g.timer_task.done()]
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    print(f"Cancelled {len(tasks)} game timers.")
+
 # ---------- Запуск ----------
 async def main():
     await on_startup()
 
     # запускаем бот и веб-сервер параллельно
+    send_task = asyncio.create_task(send_worker())
     bot_task = asyncio.create_task(dp.start_polling(bot))
     web_task = asyncio.create_task(start_web_server())
 
     print("Bot + Web server started")
-    await asyncio.gather(bot_task, web_task)
+    try:
+        await asyncio.gather(bot_task, web_task)
+    finally:
+        await cancel_and_await(send_task)
+        await close_db()
 
 if __name__ == "__main__":
     try: